@@ -5,21 +5,25 @@ Handles extraction, policy, anomaly, and remediation via Pub/Sub
 
 import os
 import sys
-import json
 import time
 import logging
-import re
 import random
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Dict, Any, Optional
 from datetime import datetime, timezone
 
+import orjson
 from google.cloud import pubsub_v1, firestore, storage
 from google.cloud.firestore_v1 import FieldFilter
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
 from google.cloud.pubsub_v1.types import FlowControl
 from google.api_core import exceptions
 from google.api_core.exceptions import InvalidArgument
 import vertexai
+from requests.adapters import HTTPAdapter
 from vertexai.generative_models import GenerativeModel, Part, GenerationConfig
 
 # Configure logging
@@ -47,37 +51,138 @@ AGENT_QPS = float(os.getenv("AGENT_QPS", "2"))
 # Initialize clients
 vertexai.init(project=PROJECT_ID, location=MODEL_LOCATION)
 subscriber = pubsub_v1.SubscriberClient()
-publisher = pubsub_v1.PublisherClient()
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=pubsub_v1.types.BatchSettings(
+        max_messages=100,
+        max_bytes=1_000_000,
+        max_latency=0.05,
+    )
+)
+# Resolved once; publish_downstream runs on every processed message
+_TOPIC_OUT_PATH = publisher.topic_path(PROJECT_ID, TOPIC_OUT) if TOPIC_OUT else None
 db = firestore.Client(project=PROJECT_ID)
 gcs_client = storage.Client(project=PROJECT_ID)
 
 
 MAX_ITEM_COUNT = 12
 MAX_STRING_LENGTH = 256
-MAX_AUDIT_LOG_ENTRIES = 50
 MAX_AUDIT_FIELD_LENGTH = 512
 MAX_INFLIGHT_MESSAGES = int(os.getenv("MAX_INFLIGHT_MESSAGES", "4"))
 MAX_INFLIGHT_BYTES = int(os.getenv("MAX_INFLIGHT_BYTES", str(4 * 1024 * 1024)))
+DUPLICATE_SCAN_LIMIT = 20
+CATEGORY_LIMITS = MappingProxyType({
+    "meals": 100,
+    "transportation": 200,
+    "office_supplies": 500,
+    "lodging": 300,
+})
+DEFAULT_CATEGORY_LIMIT = 200
+POLICY_CACHE_TTL_SECONDS = float(os.getenv("POLICY_CACHE_TTL_SECONDS", "300"))
+MAX_LEASE_DURATION = int(os.getenv("MAX_LEASE_DURATION", "900"))
+# Grace period before a message whose expense document is missing is dropped
+MISSING_DOC_MAX_AGE_SECONDS = int(os.getenv("MISSING_DOC_MAX_AGE_SECONDS", "30"))
+# Downstream publish must be confirmed before the upstream message is acked
+PUBLISH_ACK_TIMEOUT_SECONDS = 10
+IMAGE_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+TEXT_EXTENSIONS = frozenset({".txt", ".csv", ".md"})
+FINAL_STATUSES = frozenset({"APPROVED", "REJECTED", "COMPLETED", "FAILED", "NEEDS_REVIEW"})
+# Expense fields each worker type needs: status for the skip check plus the
+# findings it consumes or checks for idempotency
+AGENT_FIELD_PATHS = {
+    "extraction": ["status", "findings.extraction"],
+    "policy": ["status", "findings.extraction", "findings.policy"],
+    "anomaly": ["status", "findings.extraction", "findings.anomaly"],
+    "parallel_post_extraction": ["status", "findings.extraction", "findings.policy", "findings.anomaly"],
+    "remediation": ["status", "findings"],
+}
+# Findings stages each agent type is responsible for writing
+AGENT_STAGES = {
+    "extraction": ("extraction",),
+    "policy": ("policy",),
+    "anomaly": ("anomaly",),
+    "parallel_post_extraction": ("policy", "anomaly"),
+    "remediation": ("remediation",),
+}
+COMPLETED_STAGE_TTL_SECONDS = 5.0
+COMPLETED_STAGE_CACHE_MAX_ENTRIES = 10_000
+
+# Deletes every ASCII character except digits, '.' and '-'
+_AMOUNT_DELETE_TABLE = {code: None for code in range(128) if chr(code) not in "0123456789.-"}
+
+# Structured-output schemas; Gemini returns bare JSON matching these
+_EXTRACTION_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "merchant": {"type": "STRING"},
+        "total_amount": {"type": "NUMBER"},
+        "currency": {"type": "STRING", "nullable": True},
+        "date": {"type": "STRING", "nullable": True},
+        "category": {
+            "type": "STRING",
+            "enum": ["meals", "transportation", "lodging", "office_supplies", "other"],
+        },
+        "items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "price": {"type": "NUMBER"},
+                    "quantity": {"type": "NUMBER", "nullable": True},
+                },
+                "required": ["name", "price"],
+            },
+        },
+        "tax": {"type": "NUMBER", "nullable": True},
+        "subtotal": {"type": "NUMBER", "nullable": True},
+        "payment_method": {"type": "STRING", "nullable": True},
+        "has_alcohol": {"type": "BOOLEAN"},
+        "business_purpose": {"type": "STRING", "nullable": True},
+    },
+    "required": ["merchant", "total_amount", "category", "has_alcohol"],
+}
+_POLICY_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "compliant": {"type": "BOOLEAN"},
+        "verdict": {"type": "STRING", "enum": ["APPROVED", "REJECTED", "NEEDS_REVIEW"]},
+        "violations": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "citations": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "reasoning": {"type": "STRING"},
+        "recommended_action": {"type": "STRING"},
+    },
+    "required": ["compliant", "verdict", "violations", "citations", "reasoning", "recommended_action"],
+}
 
 
 def _clean_string(value: Optional[Any], max_len: int = MAX_STRING_LENGTH) -> str:
     if value is None:
         return ""
-    if isinstance(value, (int, float)):
+    if type(value) is not str:
         value = str(value)
-    value = str(value).strip()
+    value = value.strip()
     if len(value) > max_len:
         return value[: max_len - 3] + "..."
     return value
 
 
 def _parse_amount(value: Optional[Any]) -> float:
+    if type(value) is float:
+        return value
+    if type(value) is int:
+        return float(value)
     if value is None:
         return 0.0
     if isinstance(value, (int, float)):
         return float(value)
     if isinstance(value, str):
-        cleaned = re.sub(r"[^0-9.\-]", "", value.replace(",", ""))
+        cleaned = value.encode("ascii", "ignore").decode("ascii").translate(_AMOUNT_DELETE_TABLE)
         if cleaned in {"", "-", ".", "-."}:
             return 0.0
         try:
@@ -117,17 +222,22 @@ def sanitize_extracted_data(
     source_type: str,
     raw_text_snippet: Optional[str] = None,
 ) -> Dict[str, Any]:
+    # Empty strings are dropped as the dict is built to keep the Firestore doc small
     sanitized: Dict[str, Any] = {
-        "merchant": _clean_string(raw_extraction.get("merchant") or "Unknown"),
-        "total_amount": round(_parse_amount(raw_extraction.get("total_amount")), 2),
-        "currency": _clean_string(raw_extraction.get("currency") or "USD", max_len=16),
-        "date": _clean_string(raw_extraction.get("date"), max_len=32),
-        "category": _clean_string(raw_extraction.get("category") or "other", max_len=64),
-        "payment_method": _clean_string(raw_extraction.get("payment_method"), max_len=64),
-        "has_alcohol": bool(raw_extraction.get("has_alcohol", False)),
-        "business_purpose": _clean_string(raw_extraction.get("business_purpose"), max_len=400),
-        "source_type": source_type,
-        "model": EXTRACTION_MODEL,
+        key: value
+        for key, value in (
+            ("merchant", _clean_string(raw_extraction.get("merchant") or "Unknown")),
+            ("total_amount", round(_parse_amount(raw_extraction.get("total_amount")), 2)),
+            ("currency", _clean_string(raw_extraction.get("currency") or "USD", max_len=16)),
+            ("date", _clean_string(raw_extraction.get("date"), max_len=32)),
+            ("category", _clean_string(raw_extraction.get("category") or "other", max_len=64)),
+            ("payment_method", _clean_string(raw_extraction.get("payment_method"), max_len=64)),
+            ("has_alcohol", bool(raw_extraction.get("has_alcohol", False))),
+            ("business_purpose", _clean_string(raw_extraction.get("business_purpose"), max_len=400)),
+            ("source_type", source_type),
+            ("model", EXTRACTION_MODEL),
+        )
+        if value != ""
     }
 
     items = _sanitize_items(raw_extraction.get("items"))
@@ -144,69 +254,72 @@ def sanitize_extracted_data(
     if subtotal_value:
         sanitized["subtotal"] = round(subtotal_value, 2)
 
-    if raw_text_snippet:
-        sanitized["raw_text_snippet"] = _clean_string(raw_text_snippet, max_len=400)
+    snippet = _clean_string(raw_text_snippet, max_len=400)
+    if snippet:
+        sanitized["raw_text_snippet"] = snippet
 
-    # Remove empty strings to keep Firestore doc small
-    sanitized = {
-        key: value
-        for key, value in sanitized.items()
-        if not (isinstance(value, str) and value == "")
-    }
     sanitized["summary"] = f"{sanitized.get('merchant', 'Unknown')} ${sanitized.get('total_amount', 0.0):.2f}"
     return sanitized
 
 
 def _parse_json_response(response_text: str) -> Dict[str, Any]:
-    """Best-effort parsing for Gemini JSON responses with optional thinking text."""
-    text = response_text.strip()
-    if not text:
+    """Parse a schema-constrained Gemini JSON response."""
+    if not response_text.strip():
         raise ValueError("Model returned an empty response.")
-
-    # Remove fenced code blocks
-    if text.startswith("```"):
-        segments = text.split("```")
-        text = ""
-        for segment in segments:
-            seg = segment.strip()
-            if not seg:
-                continue
-            if seg.lower().startswith("json"):
-                newline_idx = seg.find("\n")
-                seg = seg[newline_idx + 1 :] if newline_idx != -1 else ""
-            text += seg + "\n"
-        text = text.strip()
-
-    # Strip hidden thinking tags (Gemini 2.5+)
-    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL | re.IGNORECASE)
-    text = re.sub(r"<thinking>.*?</thinking>", "", text, flags=re.DOTALL | re.IGNORECASE)
-    text = text.strip()
-
-    # Direct attempt
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-
-    # Locate first JSON object by brace matching
-    start = text.find("{")
-    while start != -1:
-        depth = 0
-        for idx in range(start, len(text)):
-            char = text[idx]
-            if char == "{":
+        parsed = orjson.loads(response_text)
+    except orjson.JSONDecodeError as exc:
+        raise ValueError(f"Unable to parse JSON from model response: {response_text}") from exc
+    if not isinstance(parsed, dict):
+        raise ValueError(f"Model response is not a JSON object: {response_text}")
+    return parsed
+
+
+def _stream_response_text(
+    model: GenerativeModel,
+    contents: Any,
+    generation_config: GenerationConfig,
+) -> str:
+    """Stream a Gemini response, returning the first top-level JSON object once it closes."""
+    # Paced per request, so retries and skipped duplicates are accounted correctly
+    token_bucket.acquire()
+    chunks: list[str] = []
+    # Text before the first "{" is dropped; the response schema makes it whitespace at most
+    started = False
+    depth = 0
+    in_string = False
+    escape = False
+    for chunk in model.generate_content(contents, generation_config=generation_config, stream=True):
+        try:
+            piece = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. the final usage chunk)
+            continue
+        if not started:
+            start = piece.find("{")
+            if start == -1:
+                continue
+            piece = piece[start:]
+            started = True
+        chunks.append(piece)
+        for index, char in enumerate(piece):
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
                 depth += 1
             elif char == "}":
                 depth -= 1
                 if depth == 0:
-                    candidate = text[start : idx + 1]
-                    try:
-                        return json.loads(candidate)
-                    except json.JSONDecodeError:
-                        break
-        start = text.find("{", start + 1)
-
-    raise ValueError(f"Unable to parse JSON from model response: {response_text}")
+                    chunks[-1] = piece[:index + 1]
+                    return "".join(chunks)
+    return "".join(chunks)
 
 
 def _resolve_model_name(model_id: str, *, location: Optional[str] = None) -> str:
@@ -220,25 +333,49 @@ def _resolve_model_name(model_id: str, *, location: Optional[str] = None) -> str
     return f"projects/{PROJECT_ID}/locations/{target_location}/publishers/google/models/{model_id}"
 
 
+_MODEL_CACHE: Dict[str, GenerativeModel] = {}
+
+
+def get_model(model_id: str, *, location: Optional[str] = None) -> GenerativeModel:
+    """Return the process-wide GenerativeModel for a model, constructing it on first use."""
+    model_name = _resolve_model_name(model_id, location=location)
+    model = _MODEL_CACHE.get(model_name)
+    if model is None:
+        model = _MODEL_CACHE.setdefault(model_name, GenerativeModel(model_name))
+    return model
+
+
 class QPSTokenBucket:
     def __init__(self, qps: float):
         self.capacity = max(qps, 0.1)
         self.tokens = self.capacity
-        self.rate = qps
+        self.rate = max(qps, 0.1)
         self.lock = threading.Lock()
         self.last = time.perf_counter()
 
-    def take(self, cost: float = 1.0) -> None:
-        while True:
-            with self.lock:
-                now = time.perf_counter()
-                elapsed = now - self.last
-                self.last = now
-                self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
-                if self.tokens >= cost:
-                    self.tokens -= cost
-                    return
-            time.sleep(0.02)
+    def _reserve(self, cost: float) -> float:
+        """Claim tokens up front and return how long the caller must wait for them."""
+        with self.lock:
+            now = time.perf_counter()
+            elapsed = now - self.last
+            self.last = now
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.tokens -= cost
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, cost: float = 1.0) -> None:
+        """Block the calling thread until the reserved tokens are available."""
+        delay = self._reserve(cost)
+        if delay > 0:
+            time.sleep(delay)
+
+
+@lru_cache(maxsize=None)
+def _backoff_schedule(max_attempts: int, base_delay: float, max_delay: float) -> tuple[float, ...]:
+    """Exponential backoff base delays, computed once per retry policy; jitter is per attempt."""
+    return tuple(min(base_delay * 2 ** i, max_delay) for i in range(max_attempts))
 
 
 def call_with_retry(
@@ -248,7 +385,7 @@ def call_with_retry(
     base_delay: float = 1.0,
     max_delay: float = 60.0,
 ):
-    delay = base_delay
+    backoff = _backoff_schedule(max_attempts, base_delay, max_delay)
     for attempt in range(1, max_attempts + 1):
         try:
             return fn()
@@ -257,20 +394,14 @@ def call_with_retry(
             exceptions.ServiceUnavailable,
             exceptions.DeadlineExceeded,
         ) as exc:
-            retry_after = None
-            for attr in ("retry_after", "Retry-After"):
-                if hasattr(exc, attr):
-                    retry_after = getattr(exc, attr)
-                    break
-
+            delay = backoff[attempt - 1]
+            sleep_seconds = delay + random.uniform(0, 0.3 * delay)
+            retry_after = getattr(exc, "retry_after", None) or getattr(exc, "Retry-After", None)
             if retry_after:
                 try:
                     sleep_seconds = float(retry_after)
                 except (TypeError, ValueError):
-                    sleep_seconds = delay
-            else:
-                jitter = random.uniform(0, delay * 0.3)
-                sleep_seconds = min(delay + jitter, max_delay)
+                    pass
 
             logger.warning(
                 "Transient Vertex AI error on attempt %d/%d: %s. Sleeping %.2fs",
@@ -280,10 +411,6 @@ def call_with_retry(
                 sleep_seconds,
             )
             time.sleep(sleep_seconds)
-            delay = min(delay * 2, max_delay)
-            continue
-        except Exception:
-            raise
     # Final attempt outside loop
     return fn()
 
@@ -291,12 +418,19 @@ def call_with_retry(
 token_bucket = QPSTokenBucket(AGENT_QPS)
 
 
-def _get_expense_doc_data(expense_id: str) -> Optional[Dict[str, Any]]:
-    try:
-        snapshot = db.collection("expenses").document(expense_id).get()
-    except Exception as exc:
-        logger.error("Failed to load expense %s: %s", expense_id, exc)
-        return None
+_POLICY_CACHE: Dict[str, Any] = {"text": None, "etag": None, "expires": 0.0}
+_POLICY_CACHE_LOCK = threading.Lock()
+# (expense_id, stage) -> monotonic expiry; lets redelivered duplicates ack without a read
+_COMPLETED_STAGES: Dict[tuple[str, str], float] = {}
+_COMPLETED_STAGES_LOCK = threading.Lock()
+
+
+def _get_expense_doc_data(
+    expense_id: str,
+    field_paths: Optional[list[str]] = None,
+) -> Optional[Dict[str, Any]]:
+    # Read errors propagate so process_message nacks; None means the document is missing
+    snapshot = db.collection("expenses").document(expense_id).get(field_paths=field_paths)
     if not snapshot.exists:
         return None
     return snapshot.to_dict() or {}
@@ -310,8 +444,27 @@ def _stage_already_completed(doc_data: Dict[str, Any], stage_key: str) -> bool:
     return stage_data is not None
 
 
+def _mark_stages_completed(expense_id: str) -> None:
+    expires = time.monotonic() + COMPLETED_STAGE_TTL_SECONDS
+    with _COMPLETED_STAGES_LOCK:
+        if len(_COMPLETED_STAGES) >= COMPLETED_STAGE_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for key in [k for k, v in _COMPLETED_STAGES.items() if v <= now]:
+                del _COMPLETED_STAGES[key]
+        for stage in AGENT_STAGES.get(AGENT_TYPE, ()):
+            _COMPLETED_STAGES[(expense_id, stage)] = expires
+
+
+def _stages_recently_completed(expense_id: str) -> bool:
+    stages = AGENT_STAGES.get(AGENT_TYPE)
+    if not stages:
+        return False
+    now = time.monotonic()
+    return all(_COMPLETED_STAGES.get((expense_id, stage), 0.0) > now for stage in stages)
+
+
 def _is_final_status(status: Optional[str]) -> bool:
-    return status in {"APPROVED", "REJECTED", "FAILED", "COMPLETED", "NEEDS_REVIEW"}
+    return status in FINAL_STATUSES
 
 
 def _sanitize_audit_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
@@ -332,37 +485,42 @@ def _format_error_message(error: Exception | str) -> str:
 def update_expense_doc(
     expense_id: str,
     updates: Dict[str, Any],
-    audit_entry: Optional[Dict[str, Any]] = None,
+    audit_entry: Optional[Dict[str, Any] | list[Dict[str, Any]]] = None,
 ) -> None:
-    """Atomically update an expense document while maintaining a bounded audit log."""
-    doc_ref = db.collection("expenses").document(expense_id)
-    def _apply_update() -> None:
-        snapshot = doc_ref.get()
-        if not snapshot.exists:
-            logger.error("Expense document %s not found while updating.", expense_id)
-            return
+    """Update an expense document, writing audit entries to its auditLog subcollection.
 
-        doc_data = snapshot.to_dict() or {}
-        merged_updates = dict(updates)
-
-        if audit_entry:
-            audit_log = doc_data.get("auditLog", [])
-            audit_log.append(_sanitize_audit_entry(audit_entry))
-            audit_log = audit_log[-MAX_AUDIT_LOG_ENTRIES:]
-            merged_updates["auditLog"] = audit_log
-
-        doc_ref.update(merged_updates)
+    The update and the audit entries are committed as one batch. The newest
+    entry is also kept inline as lastAudit.
+    """
+    doc_ref = db.collection("expenses").document(expense_id)
+    merged_updates = dict(updates)
+    entries: list[Dict[str, Any]] = []
+    if audit_entry:
+        raw_entries = audit_entry if isinstance(audit_entry, list) else [audit_entry]
+        entries = [_sanitize_audit_entry(entry) for entry in raw_entries]
+        merged_updates["lastAudit"] = entries[-1]
+
+    def _commit() -> None:
+        batch = db.batch()
+        batch.update(doc_ref, merged_updates)
+        audit_log = doc_ref.collection("auditLog")
+        for entry in entries:
+            batch.set(audit_log.document(), entry)
+        batch.commit()
 
     try:
-        _apply_update()
-    except InvalidArgument as exc:
-        message = str(exc)
-        if "exceeds the maximum allowed size" not in message:
-            raise
+        try:
+            _commit()
+        except InvalidArgument as exc:
+            message = str(exc)
+            if "exceeds the maximum allowed size" not in message:
+                raise
 
-        logger.warning("Firestore document oversized for %s. Compacting and retrying.", expense_id)
-        _compact_expense_document(doc_ref)
-        _apply_update()
+            logger.warning("Firestore document oversized for %s. Compacting and retrying.", expense_id)
+            _compact_expense_document(doc_ref)
+            _commit()
+    except exceptions.NotFound:
+        logger.error("Expense document %s not found while updating.", expense_id)
 
 
 def _compact_expense_document(doc_ref: firestore.DocumentReference) -> None:
@@ -372,10 +530,6 @@ def _compact_expense_document(doc_ref: firestore.DocumentReference) -> None:
 
     data = snapshot.to_dict() or {}
     compact_findings = data.get("findings", {})
-    compact_audit = [
-        _sanitize_audit_entry(entry)
-        for entry in data.get("auditLog", [])[-10:]
-    ]
 
     compact_doc = {
         "status": data.get("status"),
@@ -384,22 +538,38 @@ def _compact_expense_document(doc_ref: firestore.DocumentReference) -> None:
         "gcsUri": data.get("gcsUri"),
         "createdAt": data.get("createdAt"),
         "findings": compact_findings,
-        "auditLog": compact_audit,
+        "lastAudit": data.get("lastAudit"),
         "error": _clean_string(data.get("error"), max_len=MAX_AUDIT_FIELD_LENGTH),
     }
+    # Drop every other top-level field. update() with a last_update_time precondition
+    # never recreates a document deleted since the read, unlike set().
+    for key in data:
+        if key not in compact_doc:
+            compact_doc[key] = firestore.DELETE_FIELD
 
-    doc_ref.set(compact_doc, merge=False)
+    doc_ref.update(compact_doc, option=db.write_option(last_update_time=snapshot.update_time))
 
 
 def load_policy_document() -> str:
-    """Load company policy from GCS"""
-    try:
-        bucket = gcs_client.bucket(POLICY_BUCKET)
-        blob = bucket.blob("expense-policy.txt")
-        return blob.download_as_text()
-    except Exception as e:
-        logger.error(f"Failed to load policy: {e}")
-        return ""
+    """Load company policy from GCS, revalidating the cached copy by etag after the TTL"""
+    if _POLICY_CACHE["text"] is not None and time.monotonic() < _POLICY_CACHE["expires"]:
+        return _POLICY_CACHE["text"]
+
+    with _POLICY_CACHE_LOCK:
+        if _POLICY_CACHE["text"] is not None and time.monotonic() < _POLICY_CACHE["expires"]:
+            return _POLICY_CACHE["text"]
+        try:
+            bucket = gcs_client.bucket(POLICY_BUCKET)
+            blob = bucket.blob("expense-policy.txt")
+            blob.reload()
+            if _POLICY_CACHE["text"] is None or blob.etag != _POLICY_CACHE["etag"]:
+                _POLICY_CACHE["text"] = blob.download_as_text()
+                _POLICY_CACHE["etag"] = blob.etag
+            _POLICY_CACHE["expires"] = time.monotonic() + POLICY_CACHE_TTL_SECONDS
+            return _POLICY_CACHE["text"]
+        except Exception as e:
+            logger.error(f"Failed to load policy: {e}")
+            return _POLICY_CACHE["text"] or ""
 
 
 def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
@@ -407,30 +577,21 @@ def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
     logger.info(f"Extraction agent processing {expense_id}")
     
     try:
-        update_expense_doc(
-            expense_id,
-            {
-                "status": "EXTRACTING",
-                "version": firestore.Increment(1),
-            },
-            {
-                "actor": "extraction_agent",
-                "action": "STARTED",
-            },
-        )
-        
         # Download receipt content
-        bucket_name = gcs_uri.replace("gs://", "").split("/")[0]
-        blob_path = "/".join(gcs_uri.replace("gs://", "").split("/")[1:])
+        bucket_name, blob_path = gcs_uri[len("gs://"):].split("/", 1)
         bucket = gcs_client.bucket(bucket_name)
         blob = bucket.blob(blob_path)
         
-        # Determine if it's an image or text
-        content_type = blob.content_type or ""
-        is_image = content_type.startswith("image/") or blob_path.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))
+        # Determine if it's an image or text; only fetch metadata when the extension doesn't tell
+        extension = os.path.splitext(blob_path)[1].lower()
+        content_type = IMAGE_MIME_TYPES.get(extension, "")
+        if not content_type and extension not in TEXT_EXTENSIONS:
+            blob.reload()
+            content_type = blob.content_type or ""
+        is_image = content_type.startswith("image/")
         
         # Initialize Gemini model
-        model = GenerativeModel(_resolve_model_name(EXTRACTION_MODEL, location=EXTRACTION_MODEL_LOCATION))
+        model = get_model(EXTRACTION_MODEL, location=EXTRACTION_MODEL_LOCATION)
         
         raw_text_snippet: Optional[str] = None
         source_type = "image" if is_image else "text"
@@ -455,20 +616,21 @@ def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
             Return ONLY valid JSON, no markdown formatting.
             """
             
-            token_bucket.take()
-            response = call_with_retry(
-                lambda: model.generate_content(
+            response_text = call_with_retry(
+                lambda: _stream_response_text(
+                    model,
                     [prompt, image_part],
                     generation_config=GenerationConfig(
                         temperature=0.2,
                         response_mime_type="application/json",
+                        response_schema=_EXTRACTION_SCHEMA,
                         max_output_tokens=512,
                     ),
                 )
             )
         else:
             # Use text processing for text receipts
-            receipt_text = blob.download_as_text()
+            receipt_text = blob.download_as_bytes().decode("utf-8", errors="replace")
             raw_text_snippet = receipt_text[:400]
             prompt = f"""
             Analyze this receipt text and extract the following information as JSON:
@@ -490,20 +652,20 @@ def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
             Return ONLY valid JSON, no markdown formatting.
             """
             
-            token_bucket.take()
-            response = call_with_retry(
-                lambda: model.generate_content(
+            response_text = call_with_retry(
+                lambda: _stream_response_text(
+                    model,
                     prompt,
                     generation_config=GenerationConfig(
                         temperature=0.2,
                         response_mime_type="application/json",
+                        response_schema=_EXTRACTION_SCHEMA,
                         max_output_tokens=512,
                     ),
                 )
             )
         
         # Parse Gemini response
-        response_text = response.text or ""
         extracted_data = _parse_json_response(response_text)
         sanitized_extraction = sanitize_extracted_data(
             extracted_data,
@@ -517,9 +679,7 @@ def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
             {
                 "status": "EXTRACTED",
                 "version": firestore.Increment(1),
-                "findings": {
-                    "extraction": sanitized_extraction
-                },
+                "findings.extraction": sanitized_extraction,
             },
             {
                 "actor": "extraction_agent",
@@ -553,29 +713,21 @@ def extraction_agent(expense_id: str, gcs_uri: str) -> Dict[str, Any]:
         raise
 
 
-def policy_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+def policy_agent(
+    expense_id: str,
+    extracted_data: Dict[str, Any],
+    *,
+    update_status: bool = True,
+) -> Dict[str, Any]:
     """Check policy compliance using Gemini Pro + ADK"""
     logger.info(f"Policy agent processing {expense_id}")
     
     try:
-        # Update status
-        update_expense_doc(
-            expense_id,
-            {
-                "status": "CHECKING_POLICY",
-                "version": firestore.Increment(1),
-            },
-            {
-                "actor": "policy_agent",
-                "action": "STARTED",
-            },
-        )
-        
         # Load company policy
         policy_text = load_policy_document()
         
         # Use Gemini Pro for policy reasoning
-        model = GenerativeModel(_resolve_model_name(POLICY_MODEL, location=POLICY_MODEL_LOCATION))
+        model = get_model(POLICY_MODEL, location=POLICY_MODEL_LOCATION)
         
         merchant = extracted_data.get("merchant", "Unknown")
         amount = extracted_data.get("total_amount", 0)
@@ -594,7 +746,7 @@ def policy_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str, A
         - Amount: ${amount}
         - Category: {category}
         - Has Alcohol: {has_alcohol}
-        - Items: {json.dumps(items)}
+        - Items: {orjson.dumps(items).decode()}
         
         TASK:
         1. Determine if this expense is compliant with the policy
@@ -615,30 +767,33 @@ def policy_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str, A
         Return ONLY valid JSON.
         """
         
-        token_bucket.take()
-        response = call_with_retry(
-            lambda: model.generate_content(
+        response_text = call_with_retry(
+            lambda: _stream_response_text(
+                model,
                 prompt,
                 generation_config=GenerationConfig(
                     temperature=0.2,
                     top_p=0.95,
+                    response_mime_type="application/json",
+                    response_schema=_POLICY_SCHEMA,
                     max_output_tokens=512,
                 )
             )
         )
         
         # Parse response
-        response_text = response.text or ""
         policy_result = _parse_json_response(response_text)
         
         # Update Firestore
+        updates = {
+            "version": firestore.Increment(1),
+            "findings.policy": policy_result,
+        }
+        if update_status:
+            updates["status"] = "POLICY_CHECKED"
         update_expense_doc(
             expense_id,
-            {
-                "status": "POLICY_CHECKED",
-                "version": firestore.Increment(1),
-                "findings.policy": policy_result,
-            },
+            updates,
             {
                 "actor": "policy_agent",
                 "action": "COMPLETED",
@@ -667,23 +822,16 @@ def policy_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str, A
         raise
 
 
-def anomaly_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+def anomaly_agent(
+    expense_id: str,
+    extracted_data: Dict[str, Any],
+    *,
+    update_status: bool = True,
+) -> Dict[str, Any]:
     """Detect anomalies and fraud patterns"""
     logger.info(f"Anomaly agent processing {expense_id}")
     
     try:
-        update_expense_doc(
-            expense_id,
-            {
-                "status": "CHECKING_ANOMALIES",
-                "version": firestore.Increment(1),
-            },
-            {
-                "actor": "anomaly_agent",
-                "action": "STARTED",
-            },
-        )
-        
         anomalies = []
         risk_score = 0
         
@@ -691,32 +839,29 @@ def anomaly_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str,
         merchant = extracted_data.get("merchant", "")
         category = extracted_data.get("category", "")
         
-        # Check for duplicate submissions (same merchant, similar amount, recent)
+        # Check for duplicate submissions (same merchant, similar amount, recent).
+        # Served by the (findings.extraction.merchant, createdAt DESC) composite index.
         recent_cutoff = datetime.now(timezone.utc).timestamp() - (7 * 24 * 3600)  # 7 days
-        similar_expenses = db.collection("expenses").where(
-            filter=FieldFilter("createdAt", ">=", datetime.fromtimestamp(recent_cutoff, timezone.utc))
-        ).stream()
+        similar_expenses = (
+            db.collection("expenses")
+            .where(filter=FieldFilter("findings.extraction.merchant", "==", merchant))
+            .where(filter=FieldFilter("createdAt", ">=", datetime.fromtimestamp(recent_cutoff, timezone.utc)))
+            .order_by("createdAt", direction=firestore.Query.DESCENDING)
+            .limit(DUPLICATE_SCAN_LIMIT)
+            .stream()
+        )
         
         for expense in similar_expenses:
+            if expense.id == expense_id:
+                continue
             exp_data = expense.to_dict()
-            exp_findings = exp_data.get("findings", {})
-            exp_extraction = exp_findings.get("extraction", {})
-            
-            if expense.id != expense_id:
-                if (exp_extraction.get("merchant") == merchant and 
-                    abs(exp_extraction.get("total_amount", 0) - amount) < 5):
-                    anomalies.append(f"Potential duplicate: Similar expense to {merchant} for ${amount}")
-                    risk_score += 30
+            exp_extraction = exp_data.get("findings", {}).get("extraction", {})
+            if abs(exp_extraction.get("total_amount", 0) - amount) < 5:
+                anomalies.append(f"Potential duplicate: Similar expense to {merchant} for ${amount}")
+                risk_score += 30
         
         # Check for unusually high amounts
-        category_limits = {
-            "meals": 100,
-            "transportation": 200,
-            "office_supplies": 500,
-            "lodging": 300
-        }
-        
-        limit = category_limits.get(category, 200)
+        limit = CATEGORY_LIMITS.get(category, DEFAULT_CATEGORY_LIMIT)
         if amount > limit:
             anomalies.append(f"High amount for {category}: ${amount} exceeds typical limit ${limit}")
             risk_score += 20
@@ -733,13 +878,15 @@ def anomaly_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str,
             "risk_level": "high" if risk_score > 50 else "medium" if risk_score > 20 else "low"
         }
         
+        updates = {
+            "version": firestore.Increment(1),
+            "findings.anomaly": result,
+        }
+        if update_status:
+            updates["status"] = "ANOMALY_CHECKED"
         update_expense_doc(
             expense_id,
-            {
-                "status": "ANOMALY_CHECKED",
-                "version": firestore.Increment(1),
-                "findings.anomaly": result,
-            },
+            updates,
             {
                 "actor": "anomaly_agent",
                 "action": "COMPLETED",
@@ -768,23 +915,48 @@ def anomaly_agent(expense_id: str, extracted_data: Dict[str, Any]) -> Dict[str,
         raise
 
 
+# Shared by all in-flight messages; two agents per message never wait on each other
+_POST_EXTRACTION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=2 * max(1, MAX_INFLIGHT_MESSAGES),
+    thread_name_prefix="post-extraction",
+)
+
+
+def run_post_extraction_agents(
+    expense_id: str,
+    extracted_data: Dict[str, Any],
+    doc_data: Dict[str, Any],
+) -> tuple[Dict[str, Any], Dict[str, Any]]:
+    """Run policy and anomaly checks concurrently; both depend only on the extraction.
+
+    A stage already recorded in the document's findings (e.g. from a partially
+    failed earlier delivery) is reused rather than rerun. The agents persist only
+    their findings; the combined stage writes the status once both are done.
+    """
+    agents = {"policy": policy_agent, "anomaly": anomaly_agent}
+    findings = doc_data.get("findings", {})
+    results = {stage: findings[stage] for stage in agents if _stage_already_completed(doc_data, stage)}
+    pending = [stage for stage in agents if stage not in results]
+    if len(pending) == 1:
+        stage = pending[0]
+        results[stage] = agents[stage](expense_id, extracted_data, update_status=False)
+    elif pending:
+        futures = {
+            stage: _POST_EXTRACTION_EXECUTOR.submit(agents[stage], expense_id, extracted_data, update_status=False)
+            for stage in pending
+        }
+        for stage, future in futures.items():
+            results[stage] = future.result()
+    if pending:
+        update_expense_doc(expense_id, {"status": "ANOMALY_CHECKED", "version": firestore.Increment(1)})
+    return results["policy"], results["anomaly"]
+
+
 def remediation_agent(expense_id: str, findings: Dict[str, Any]) -> Dict[str, Any]:
-    """Generate remediation recommendations"""
+    """Generate remediation recommendations; persisted by synthesis_agent's final write"""
     logger.info(f"Remediation agent processing {expense_id}")
     
     try:
-        update_expense_doc(
-            expense_id,
-            {
-                "status": "GENERATING_REMEDIATION",
-                "version": firestore.Increment(1),
-            },
-            {
-                "actor": "remediation_agent",
-                "action": "STARTED",
-            },
-        )
-        
         policy_result = findings.get("policy", {})
         anomaly_result = findings.get("anomaly", {})
         extraction = findings.get("extraction", {})
@@ -836,20 +1008,6 @@ def remediation_agent(expense_id: str, findings: Dict[str, Any]) -> Dict[str, An
             "auto_approvable": len(recommendations) == 0 and policy_result.get("compliant", False)
         }
         
-        update_expense_doc(
-            expense_id,
-            {
-                "status": "REMEDIATION_COMPLETE",
-                "version": firestore.Increment(1),
-                "findings.remediation": result,
-            },
-            {
-                "actor": "remediation_agent",
-                "action": "COMPLETED",
-                "recommendations_count": len(recommendations),
-            },
-        )
-        
         logger.info(f"Remediation complete: {len(recommendations)} recommendations")
         return result
         
@@ -871,19 +1029,11 @@ def remediation_agent(expense_id: str, findings: Dict[str, Any]) -> Dict[str, An
         raise
 
 
-def synthesis_agent(expense_id: str) -> Dict[str, Any]:
-    """Synthesize all findings into final verdict"""
+def synthesis_agent(expense_id: str, findings: Dict[str, Any]) -> Dict[str, Any]:
+    """Synthesize all findings into final verdict, writing it with the remediation findings"""
     logger.info(f"Synthesis agent processing {expense_id}")
     
     try:
-        # Get all findings
-        doc = db.collection("expenses").document(expense_id).get()
-        if not doc.exists:
-            raise ValueError("Expense document not found")
-        
-        data = doc.to_dict()
-        findings = data.get("findings", {})
-        
         extraction = findings.get("extraction", {})
         policy = findings.get("policy", {})
         anomaly = findings.get("anomaly", {})
@@ -907,29 +1057,40 @@ def synthesis_agent(expense_id: str) -> Dict[str, Any]:
             confidence = 98
             summary = f"All checks passed for {extraction.get('merchant')} - ${extraction.get('total_amount')}"
         
+        completed_at = datetime.now(timezone.utc).isoformat()
         result = {
             "verdict": final_verdict,
             "confidence": confidence,
             "summary": summary,
             "amount": extraction.get("total_amount", 0),
             "merchant": extraction.get("merchant", "Unknown"),
-            "completedAt": datetime.now(timezone.utc).isoformat()
+            "completedAt": completed_at
         }
         
-        # Final update
+        # Final update: remediation and synthesis land together with one version bump
         update_expense_doc(
             expense_id,
             {
                 "status": final_verdict,
                 "version": firestore.Increment(1),
+                "findings.remediation": remediation,
                 "findings.synthesis": result,
-                "completedAt": datetime.now(timezone.utc),
-            },
-            {
-                "actor": "synthesis_agent",
-                "action": "COMPLETED",
-                "verdict": final_verdict,
+                "completedAt": firestore.SERVER_TIMESTAMP,
             },
+            [
+                {
+                    "actor": "remediation_agent",
+                    "action": "COMPLETED",
+                    "recommendations_count": len(remediation.get("recommendations", [])),
+                    "ts": completed_at,
+                },
+                {
+                    "actor": "synthesis_agent",
+                    "action": "COMPLETED",
+                    "verdict": final_verdict,
+                    "ts": completed_at,
+                },
+            ],
         )
         
         logger.info(f"Synthesis complete: {final_verdict} with {confidence}% confidence")
@@ -953,109 +1114,162 @@ def synthesis_agent(expense_id: str) -> Dict[str, Any]:
         raise
 
 
+_pending_publishes: set = set()
+_pending_publishes_lock = threading.Lock()
+
+
+def _on_publish_done(future) -> None:
+    with _pending_publishes_lock:
+        _pending_publishes.discard(future)
+    try:
+        future.result()
+    except Exception as exc:
+        logger.error("Failed to publish to %s: %s", TOPIC_OUT, exc)
+
+
+def publish_downstream(payload: Dict[str, Any]) -> pubsub_v1.publisher.futures.Future:
+    """Publish to TOPIC_OUT without blocking; failures are logged when the batch settles"""
+    future = publisher.publish(_TOPIC_OUT_PATH, orjson.dumps(payload))
+    with _pending_publishes_lock:
+        _pending_publishes.add(future)
+    future.add_done_callback(_on_publish_done)
+    return future
+
+
+def _flush_publishes(timeout: float = 30.0) -> None:
+    with _pending_publishes_lock:
+        pending = list(_pending_publishes)
+    if pending:
+        logger.info("Waiting for %d pending publishes", len(pending))
+        wait(pending, timeout=timeout)
+
+
 def process_message(message: pubsub_v1.subscriber.message.Message):
     """Process a single Pub/Sub message"""
     try:
-        data = json.loads(message.data.decode('utf-8'))
+        data = orjson.loads(message.data)
         expense_id = data.get("expenseId")
         gcs_uri = data.get("gcsUri")
+        publish_future = None
         
         logger.info(f"Processing message for expense {expense_id}, agent type: {AGENT_TYPE}")
 
-        doc_data_for_skip = _get_expense_doc_data(expense_id)
-        if doc_data_for_skip and _is_final_status(doc_data_for_skip.get("status")):
+        if _stages_recently_completed(expense_id):
+            logger.info("Duplicate delivery for %s; %s stage just completed.", expense_id, AGENT_TYPE)
+            message.ack()
+            return
+
+        # Single projected read per message; every branch and agent works from this snapshot
+        doc_dict = _get_expense_doc_data(expense_id, AGENT_FIELD_PATHS.get(AGENT_TYPE))
+        if doc_dict is None:
+            # The orchestrator writes the document before publishing, so a document
+            # still missing after a short grace period was deleted or never written
+            age = time.time() - message.publish_time.timestamp()
+            if age > MISSING_DOC_MAX_AGE_SECONDS:
+                logger.error(
+                    "Expense document %s still missing %.0fs after publish. Dropping message.",
+                    expense_id,
+                    age,
+                )
+                message.ack()
+                return
+            logger.warning("Expense document %s not found yet. Nacking for retry.", expense_id)
+            message.nack()
+            return
+        if _is_final_status(doc_dict.get("status")):
             logger.info(
                 "Expense %s already finalized with status %s. Skipping %s worker.",
                 expense_id,
-                doc_data_for_skip.get("status"),
+                doc_dict.get("status"),
                 AGENT_TYPE,
             )
+            _mark_stages_completed(expense_id)
             message.ack()
             return
+        findings = doc_dict.get("findings", {})
         
+        # A stage already recorded in findings is not rerun, but its downstream message is
+        # republished: an earlier delivery may have written findings and then failed to
+        # publish. Downstream workers are idempotent, so a duplicate publish is safe.
         if AGENT_TYPE == "extraction":
-            if doc_data_for_skip and _stage_already_completed(doc_data_for_skip, "extraction"):
-                logger.info("Skipping extraction for %s; stage already marked complete.", expense_id)
-                message.ack()
-                return
-            # Extract data and publish to next topic
-            extracted_data = extraction_agent(expense_id, gcs_uri)
-            if TOPIC_OUT:
-                topic_path = publisher.topic_path(PROJECT_ID, TOPIC_OUT)
-                publisher.publish(topic_path, json.dumps({
+            if _stage_already_completed(doc_dict, "extraction"):
+                logger.info("Extraction for %s already complete; republishing stored findings.", expense_id)
+                extracted_data = findings["extraction"]
+            else:
+                # Extract data and publish to next topic
+                extracted_data = extraction_agent(expense_id, gcs_uri)
+            if _TOPIC_OUT_PATH:
+                publish_future = publish_downstream({
                     "expenseId": expense_id,
                     "gcsUri": gcs_uri,
                     "extracted": extracted_data
-                }).encode('utf-8'))
+                })
                 logger.info(f"Published to {TOPIC_OUT}")
         
         elif AGENT_TYPE == "policy":
-            if doc_data_for_skip and _stage_already_completed(doc_data_for_skip, "policy"):
-                logger.info("Skipping policy check for %s; stage already complete.", expense_id)
-                message.ack()
-                return
-            doc_dict = doc_data_for_skip or _get_expense_doc_data(expense_id)
-            if not doc_dict:
-                logger.warning("Policy worker could not load expense document %s. Nacking for retry.", expense_id)
-                message.nack()
-                return
-            # Get extracted data from Firestore
-            findings = doc_dict.get("findings", {})
-            extracted_data = findings.get("extraction", {})
-            if not extracted_data:
-                logger.warning("Policy worker missing extraction findings for %s. Nacking.", expense_id)
-                message.nack()
-                return
-            
-            # Check policy
-            policy_result = policy_agent(expense_id, extracted_data)
+            if _stage_already_completed(doc_dict, "policy"):
+                logger.info("Policy check for %s already complete; republishing stored findings.", expense_id)
+                policy_result = findings["policy"]
+            else:
+                # Get extracted data from Firestore
+                extracted_data = findings.get("extraction", {})
+                if not extracted_data:
+                    logger.warning("Policy worker missing extraction findings for %s. Nacking.", expense_id)
+                    message.nack()
+                    return
+                
+                # Check policy
+                policy_result = policy_agent(expense_id, extracted_data)
             
-            if TOPIC_OUT:
-                topic_path = publisher.topic_path(PROJECT_ID, TOPIC_OUT)
-                publisher.publish(topic_path, json.dumps({
+            if _TOPIC_OUT_PATH:
+                publish_future = publish_downstream({
                     "expenseId": expense_id,
                     "policy": policy_result
-                }).encode('utf-8'))
+                })
         
         elif AGENT_TYPE == "anomaly":
-            if doc_data_for_skip and _stage_already_completed(doc_data_for_skip, "anomaly"):
-                logger.info("Skipping anomaly check for %s; stage already complete.", expense_id)
-                message.ack()
-                return
-            doc_dict = doc_data_for_skip or _get_expense_doc_data(expense_id)
-            if not doc_dict:
-                logger.warning("Anomaly worker could not load expense document %s. Nacking for retry.", expense_id)
-                message.nack()
-                return
-            # Get extracted data
-            findings = doc_dict.get("findings", {})
+            if _stage_already_completed(doc_dict, "anomaly"):
+                logger.info("Anomaly check for %s already complete; republishing stored findings.", expense_id)
+                anomaly_result = findings["anomaly"]
+            else:
+                # Get extracted data
+                extracted_data = findings.get("extraction", {})
+                if not extracted_data:
+                    logger.warning("Anomaly worker missing extraction findings for %s. Nacking.", expense_id)
+                    message.nack()
+                    return
+                
+                anomaly_result = anomaly_agent(expense_id, extracted_data)
+            
+            if _TOPIC_OUT_PATH:
+                publish_future = publish_downstream({
+                    "expenseId": expense_id,
+                    "anomaly": anomaly_result
+                })
+        
+        elif AGENT_TYPE == "parallel_post_extraction":
             extracted_data = findings.get("extraction", {})
             if not extracted_data:
-                logger.warning("Anomaly worker missing extraction findings for %s. Nacking.", expense_id)
+                logger.warning("Post-extraction worker missing extraction findings for %s. Nacking.", expense_id)
                 message.nack()
                 return
-            
-            anomaly_result = anomaly_agent(expense_id, extracted_data)
-            
-            if TOPIC_OUT:
-                topic_path = publisher.topic_path(PROJECT_ID, TOPIC_OUT)
-                publisher.publish(topic_path, json.dumps({
+
+            # Stages already in findings are reused, so a full duplicate only republishes
+            policy_result, anomaly_result = run_post_extraction_agents(expense_id, extracted_data, doc_dict)
+
+            if _TOPIC_OUT_PATH:
+                publish_future = publish_downstream({
                     "expenseId": expense_id,
+                    "policy": policy_result,
                     "anomaly": anomaly_result
-                }).encode('utf-8'))
+                })
         
         elif AGENT_TYPE == "remediation":
-            if doc_data_for_skip and _stage_already_completed(doc_data_for_skip, "remediation"):
+            if _stage_already_completed(doc_dict, "remediation"):
                 logger.info("Skipping remediation for %s; stage already complete.", expense_id)
+                _mark_stages_completed(expense_id)
                 message.ack()
                 return
-            # Get all findings
-            doc_dict = doc_data_for_skip or _get_expense_doc_data(expense_id)
-            if not doc_dict:
-                logger.warning("Remediation worker could not load expense document %s. Nacking for retry.", expense_id)
-                message.nack()
-                return
-            findings = doc_dict.get("findings", {})
             if not findings:
                 logger.warning("Remediation worker missing findings for %s. Nacking.", expense_id)
                 message.nack()
@@ -1063,11 +1277,16 @@ def process_message(message: pubsub_v1.subscriber.message.Message):
             
             remediation_result = remediation_agent(expense_id, findings)
             
-            # Trigger synthesis after remediation
-            # Call synthesis directly since it's the final step
-            synthesis_result = synthesis_agent(expense_id)
+            # Synthesis is the final step; it persists remediation and the verdict in one write
+            synthesis_agent(expense_id, {**findings, "remediation": remediation_result})
+        
+        # Ack only once the downstream message is durable; the wait overlaps with
+        # the batch flush so it adds at most max_latency per message
+        if publish_future is not None:
+            publish_future.result(timeout=PUBLISH_ACK_TIMEOUT_SECONDS)
         
         # Acknowledge message
+        _mark_stages_completed(expense_id)
         message.ack()
         logger.info(f"Message processed and acknowledged for {expense_id}")
         
@@ -1077,6 +1296,22 @@ def process_message(message: pubsub_v1.subscriber.message.Message):
         message.nack()
 
 
+def _warm_clients() -> None:
+    """Size the GCS connection pool and connect Firestore before the first message."""
+    pool_size = max(1, MAX_INFLIGHT_MESSAGES)
+    if AGENT_TYPE == "parallel_post_extraction":
+        # Policy and anomaly run concurrently for each in-flight message
+        pool_size *= 2
+    gcs_client._http.mount(
+        "https://",
+        HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size * 2),
+    )
+    try:
+        db.collection("expenses").limit(1).get()
+    except Exception as exc:
+        logger.warning("Firestore warm-up failed: %s", exc)
+
+
 def main():
     """Main worker loop - pull messages from Pub/Sub"""
     if not SUBSCRIPTION:
@@ -1089,15 +1324,31 @@ def main():
     logger.info(f"Subscription: {subscription_path}")
     logger.info(f"Output topic: {TOPIC_OUT}")
     
-    # Pull messages
+    _warm_clients()
+    
+    # Pull messages. Keep few messages leased per replica so autoscaled replicas share
+    # the backlog; max_lease_duration only caps how long a slow message's lease is
+    # extended, and is long enough to cover Gemini retries.
+    # Callbacks run process_message on the scheduler's pool, so shutdown with
+    # await_callbacks_on_shutdown drains in-flight work while acks still go out.
+    max_messages = max(1, MAX_INFLIGHT_MESSAGES)
     flow_control = FlowControl(
-        max_messages=max(1, MAX_INFLIGHT_MESSAGES),
+        max_messages=max_messages,
         max_bytes=max(1, MAX_INFLIGHT_BYTES),
+        max_lease_duration=max(10, MAX_LEASE_DURATION),
+    )
+    scheduler = ThreadScheduler(
+        executor=ThreadPoolExecutor(
+            max_workers=max_messages,
+            thread_name_prefix=f"{AGENT_TYPE}-worker",
+        )
     )
     streaming_pull_future = subscriber.subscribe(
         subscription_path,
         callback=process_message,
         flow_control=flow_control,
+        scheduler=scheduler,
+        await_callbacks_on_shutdown=True,
     )
     
     logger.info(f"Listening for messages on {subscription_path}...")
@@ -1107,11 +1358,15 @@ def main():
         streaming_pull_future.result()
     except KeyboardInterrupt:
         streaming_pull_future.cancel()
+        # Block until in-flight callbacks have finished and acked
+        streaming_pull_future.result()
         logger.info("Worker stopped by user")
     except Exception as e:
         logger.error(f"Worker error: {e}", exc_info=True)
         streaming_pull_future.cancel()
         raise
+    finally:
+        _flush_publishes()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,13 @@
+import asyncio
+import logging
 import os
 import time
 import uuid
-import json
-from typing import AsyncGenerator, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncGenerator, Optional
 
+import orjson
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
@@ -11,19 +15,36 @@ from pydantic import BaseModel
 from starlette.responses import JSONResponse
 from sse_starlette.sse import EventSourceResponse
 
-from .services.gcs import upload_file_to_gcs
+from .services.gcs import upload_file_to_gcs, warm_client as warm_storage_client
 from .services.firestore import (
     init_expense_doc,
     get_expense_doc,
+    get_expense_doc_cached,
+    get_expense_doc_fields,
     update_expense_status,
+    watch_expense_doc,
+    warm_client as warm_firestore_client,
+    warm_listener_client,
 )
-from .services.pubsub import publish_event
+from .services.pubsub import publish_event_async, warm_publisher
+
+
+logger = logging.getLogger(__name__)
 
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 REGION = os.getenv("REGION", "us-central1")
 RECEIPTS_BUCKET = os.getenv("RECEIPTS_BUCKET", f"{PROJECT_ID}-auditai-receipts")
 TOPIC_INGESTED = os.getenv("TOPIC_INGESTED", "expenses.ingested")
+# "listener" pushes Firestore snapshots to SSE clients; "poll" is the fallback
+# for environments where streaming listeners are unavailable
+SSE_MODE = os.getenv("SSE_MODE", "listener")
+STREAM_TIMEOUT_SECONDS = 120  # Max 2 minutes
+FINAL_STATUSES = frozenset({"APPROVED", "REJECTED", "COMPLETED", "FAILED", "NEEDS_REVIEW"})
+# Poll interval backs off geometrically while the document is unchanged
+POLL_MIN_INTERVAL_SECONDS = 1
+POLL_MAX_INTERVAL_SECONDS = 8
+POLL_BACKOFF_FACTOR = 1.4
 
 
 class SubmitResponse(BaseModel):
@@ -32,7 +53,25 @@ class SubmitResponse(BaseModel):
     status: str
 
 
-app = FastAPI(title="AuditAI Orchestrator API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pay client construction and connection setup at startup, not on the first request
+    warmups = [
+        warm_firestore_client(),
+        asyncio.to_thread(warm_storage_client, RECEIPTS_BUCKET),
+        asyncio.to_thread(warm_publisher, TOPIC_INGESTED),
+    ]
+    if SSE_MODE != "poll":
+        # Snapshot listeners use the separate sync client
+        warmups.append(asyncio.to_thread(warm_listener_client))
+    results = await asyncio.gather(*warmups, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("Client warm-up failed: %s", result)
+    yield
+
+
+app = FastAPI(title="AuditAI Orchestrator API", version="0.1.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -60,57 +99,87 @@ async def submit_expense(
 ):
     if not PROJECT_ID:
         raise HTTPException(status_code=500, detail="PROJECT_ID not configured")
-    # 1) Upload to GCS
     expense_id = str(uuid.uuid4())
     object_name = f"{expense_id}/{file.filename}"
-    gcs_uri = await upload_file_to_gcs(RECEIPTS_BUCKET, object_name, file)
-
-    # 2) Create Firestore doc
-    init_expense_doc(
-        expense_id=expense_id,
-        submitter={"id": employeeId, "department": department},
-        gcs_uri=gcs_uri,
+    gcs_uri = f"gs://{RECEIPTS_BUCKET}/{object_name}"
+
+    # 1) Upload to GCS and 2) create the Firestore doc concurrently; neither reads
+    # the other's result
+    await asyncio.gather(
+        upload_file_to_gcs(RECEIPTS_BUCKET, object_name, file),
+        init_expense_doc(
+            expense_id=expense_id,
+            submitter={"id": employeeId, "department": department},
+            gcs_uri=gcs_uri,
+        ),
     )
 
-    # 3) Publish Pub/Sub event to start pipeline
-    publish_event(
-        topic=TOPIC_INGESTED,
-        message={
-            "expenseId": expense_id,
-            "gcsUri": gcs_uri,
-            "employeeId": employeeId,
-            "submissionTime": int(time.time()),
-        },
-    )
+    # 3) Publish Pub/Sub event to start pipeline only once the receipt and its
+    # document both exist, so workers never see an event without a document.
+    # Publish failures are logged by the publish future's callback.
+    try:
+        await publish_event_async(
+            topic=TOPIC_INGESTED,
+            message={
+                "expenseId": expense_id,
+                "gcsUri": gcs_uri,
+                "employeeId": employeeId,
+                "submissionTime": int(time.time()),
+            },
+        )
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail="Failed to start processing") from exc
 
     return SubmitResponse(expenseId=expense_id, gcsUri=gcs_uri, status="INGESTED")
 
 
 @app.get("/api/expenses/{expense_id}")
 async def get_expense(expense_id: str):
-    doc = get_expense_doc(expense_id)
+    doc = await get_expense_doc(expense_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Not found")
     return JSONResponse(jsonable_encoder(doc))
 
 
-@app.get("/api/expenses/{expense_id}/stream")
-async def stream_expense(expense_id: str):
-    """Stream expense updates via Server-Sent Events"""
-    import asyncio
+def _json_default(value: Any) -> str:
+    # Firestore returns DatetimeWithNanoseconds, a datetime subclass orjson does not
+    # serialize itself; emit ISO 8601 rather than str()'s space-separated form
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _sse_data(payload: dict) -> str:
+    return f"data: {orjson.dumps(payload, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode()}\n\n"
+
+
+async def _watch_expense_events(expense_id: str) -> AsyncGenerator[str, None]:
+    """Yield SSE events from a Firestore snapshot listener (one read per change)."""
+    loop = asyncio.get_running_loop()
+    updates: asyncio.Queue = asyncio.Queue()
+    # Snapshot callbacks run on the listener's thread; hop onto the event loop.
+    # Opening and closing the watch start/join its consumer thread, so both run off-loop.
+    watch = await asyncio.to_thread(
+        watch_expense_doc,
+        expense_id,
+        lambda doc: loop.call_soon_threadsafe(updates.put_nowait, doc),
+    )
+    deadline = loop.time() + STREAM_TIMEOUT_SECONDS
+    last_version: int = 0
+    completed = False
     
-    async def event_generator() -> AsyncGenerator[str, None]:
-        last_version: int = 0
-        max_iterations = 120  # Max 2 minutes
-        iteration = 0
-        completed = False
-        
-        while iteration < max_iterations:
-            iteration += 1
-            doc = get_expense_doc(expense_id)
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                doc = await asyncio.wait_for(updates.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
             
             if not doc:
-                yield f"data: {json.dumps({'error': 'NOT_FOUND'})}\n\n"
+                yield _sse_data({'error': 'NOT_FOUND'})
                 completed = True
                 break
             
@@ -118,24 +187,69 @@ async def stream_expense(expense_id: str):
             if current_version > last_version:
                 last_version = current_version
                 # Send the full document update
-                yield f"data: {json.dumps(doc, default=str)}\n\n"
+                yield _sse_data(doc)
             
             # Check if processing is complete
             status = doc.get('status', '')
-            if status in ['APPROVED', 'REJECTED', 'COMPLETED', 'FAILED', 'NEEDS_REVIEW']:
-                yield f"data: {json.dumps({'status': 'DONE', 'finalStatus': status})}\n\n"
+            if status in FINAL_STATUSES:
+                yield _sse_data({'status': 'DONE', 'finalStatus': status})
                 completed = True
                 break
-            
-            # Wait before next poll
-            sleep_seconds = 1
-            if status and status not in ['INGESTED', 'EXTRACTING', 'EXTRACTED']:
-                sleep_seconds = 2
-            await asyncio.sleep(sleep_seconds)
         
         if not completed:
-            yield f"data: {json.dumps({'status': 'TIMEOUT'})}\n\n"
+            yield _sse_data({'status': 'TIMEOUT'})
+    finally:
+        await asyncio.to_thread(watch.unsubscribe)
 
-    return EventSourceResponse(event_generator())
+
+async def _poll_expense_events(expense_id: str) -> AsyncGenerator[str, None]:
+    """Yield SSE events by polling the expense document."""
+    last_version: int = 0
+    unchanged_polls = 0
+    deadline = time.monotonic() + STREAM_TIMEOUT_SECONDS
+    completed = False
+    
+    while time.monotonic() < deadline:
+        # Probe just version/status; the full document is only read when it changed
+        probe = await get_expense_doc_fields(expense_id, ["version", "status"])
+        
+        if probe is None:
+            yield _sse_data({'error': 'NOT_FOUND'})
+            completed = True
+            break
+        
+        current_version = probe.get('version', 0)
+        if current_version > last_version:
+            unchanged_polls = 0
+            doc = await get_expense_doc_cached(expense_id, min_version=current_version)
+            if doc:
+                last_version = doc.get('version', 0)
+                # Send the full document update
+                yield _sse_data(doc)
+        else:
+            unchanged_polls += 1
+        
+        # Check if processing is complete
+        status = probe.get('status', '')
+        if status in FINAL_STATUSES:
+            yield _sse_data({'status': 'DONE', 'finalStatus': status})
+            completed = True
+            break
+        
+        # Wait before next poll, backing off while nothing changes
+        sleep_seconds = min(
+            POLL_MAX_INTERVAL_SECONDS,
+            POLL_MIN_INTERVAL_SECONDS * POLL_BACKOFF_FACTOR ** unchanged_polls,
+        )
+        await asyncio.sleep(sleep_seconds)
+    
+    if not completed:
+        yield _sse_data({'status': 'TIMEOUT'})
 
 
+@app.get("/api/expenses/{expense_id}/stream")
+async def stream_expense(expense_id: str):
+    """Stream expense updates via Server-Sent Events"""
+    if SSE_MODE == "poll":
+        return EventSourceResponse(_poll_expense_events(expense_id))
+    return EventSourceResponse(_watch_expense_events(expense_id))
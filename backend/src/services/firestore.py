@@ -1,42 +1,71 @@
+import asyncio
 import os
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from google.cloud import firestore
 
 
-_client: Optional[firestore.Client] = None
+_client: Optional[firestore.AsyncClient] = None
+# Snapshot listeners are only available on the synchronous client
+_sync_client: Optional[firestore.Client] = None
 
+EXPENSE_CACHE_TTL_SECONDS = 3.0
+EXPENSE_CACHE_MAX_ENTRIES = 10_000
+_expense_cache: Dict[str, Tuple[float, Optional[Dict[str, Any]]]] = {}
+_expense_inflight: Dict[str, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
 
-def _get_client() -> firestore.Client:
+
+def _get_client() -> firestore.AsyncClient:
     global _client
     if _client is None:
-        _client = firestore.Client(project=os.getenv("PROJECT_ID"))
+        _client = firestore.AsyncClient(project=os.getenv("PROJECT_ID"))
     return _client
 
 
-def init_expense_doc(expense_id: str, submitter: Dict[str, Any], gcs_uri: str) -> None:
-    """Initialize expense document in Firestore (synchronous)"""
+def _get_sync_client() -> firestore.Client:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = firestore.Client(project=os.getenv("PROJECT_ID"))
+    return _sync_client
+
+
+async def warm_client() -> None:
+    """Open the Firestore channel before the first request"""
+    await _get_client().collection("expenses").limit(1).get()
+
+
+def warm_listener_client() -> None:
+    """Open the sync client's channel used by snapshot listeners"""
+    _get_sync_client().collection("expenses").limit(1).get()
+
+
+async def init_expense_doc(expense_id: str, submitter: Dict[str, Any], gcs_uri: str) -> None:
+    """Initialize expense document in Firestore"""
     doc_ref = _get_client().collection("expenses").document(expense_id)
-    doc_ref.set(
+    audit_entry = {"actor": "orchestrator", "action": "INGESTED", "ts": datetime.now(timezone.utc).isoformat()}
+    batch = _get_client().batch()
+    batch.set(
+        doc_ref,
         {
             "status": "INGESTED",
             "version": 1,
             "submitter": submitter,
             "gcsUri": gcs_uri,
-            "createdAt": datetime.now(timezone.utc),
+            "createdAt": firestore.SERVER_TIMESTAMP,
             "findings": {},
-            "auditLog": [
-                {"actor": "orchestrator", "action": "INGESTED", "ts": datetime.now(timezone.utc).isoformat()}
-            ],
-        }
+            "lastAudit": audit_entry,
+        },
     )
+    batch.set(doc_ref.collection("auditLog").document(), audit_entry)
+    await batch.commit()
 
 
-def get_expense_doc(expense_id: str) -> Optional[Dict[str, Any]]:
-    """Get expense document from Firestore (synchronous)"""
+async def get_expense_doc(expense_id: str) -> Optional[Dict[str, Any]]:
+    """Get expense document from Firestore"""
     doc_ref = _get_client().collection("expenses").document(expense_id)
-    snap = doc_ref.get()
+    snap = await doc_ref.get()
     if not snap.exists:
         return None
     data = snap.to_dict()
@@ -44,18 +73,90 @@ def get_expense_doc(expense_id: str) -> Optional[Dict[str, Any]]:
     return data
 
 
-def update_expense_status(expense_id: str, status: str) -> None:
-    """Update expense status in Firestore (synchronous)"""
+async def get_expense_doc_fields(expense_id: str, field_paths: List[str]) -> Optional[Dict[str, Any]]:
+    """Get only the given fields of an expense document"""
     doc_ref = _get_client().collection("expenses").document(expense_id)
-    doc_ref.update(
+    snap = await doc_ref.get(field_paths=field_paths)
+    if not snap.exists:
+        return None
+    return snap.to_dict() or {}
+
+
+def _cache_expense_doc(expense_id: str, doc: Optional[Dict[str, Any]]) -> None:
+    now = time.monotonic()
+    if len(_expense_cache) >= EXPENSE_CACHE_MAX_ENTRIES:
+        for key in [key for key, (expires, _) in _expense_cache.items() if expires <= now]:
+            del _expense_cache[key]
+        if len(_expense_cache) >= EXPENSE_CACHE_MAX_ENTRIES:
+            del _expense_cache[next(iter(_expense_cache))]
+    _expense_cache[expense_id] = (now + EXPENSE_CACHE_TTL_SECONDS, doc)
+
+
+async def get_expense_doc_cached(expense_id: str, min_version: int = 0) -> Optional[Dict[str, Any]]:
+    """Get expense document through a short TTL cache shared by stream readers.
+
+    Concurrent callers for the same expense await a single Firestore read.
+    Cached copies older than min_version are refetched. Write paths that
+    need fresh data should use get_expense_doc.
+    """
+    cached = _expense_cache.get(expense_id)
+    if (
+        cached
+        and cached[0] > time.monotonic()
+        and (cached[1] is None or cached[1].get("version", 0) >= min_version)
+    ):
+        return cached[1]
+
+    inflight = _expense_inflight.get(expense_id)
+    if inflight is None:
+        inflight = asyncio.ensure_future(get_expense_doc(expense_id))
+        _expense_inflight[expense_id] = inflight
+
+        def _store(future: "asyncio.Future[Optional[Dict[str, Any]]]") -> None:
+            _expense_inflight.pop(expense_id, None)
+            if not future.cancelled() and future.exception() is None:
+                _cache_expense_doc(expense_id, future.result())
+
+        inflight.add_done_callback(_store)
+    # Shield so a disconnecting client does not cancel the read other callers await
+    return await asyncio.shield(inflight)
+
+
+def watch_expense_doc(
+    expense_id: str, on_change: Callable[[Optional[Dict[str, Any]]], None]
+):
+    """Listen for expense document changes; on_change runs on a background thread.
+
+    on_change receives the document dict (None if it does not exist). Call
+    unsubscribe() on the returned watch to stop listening.
+    """
+    doc_ref = _get_sync_client().collection("expenses").document(expense_id)
+
+    def _on_snapshot(snapshots, changes, read_time) -> None:
+        snap = snapshots[0] if snapshots else None
+        if snap is None or not snap.exists:
+            on_change(None)
+            return
+        data = snap.to_dict()
+        data["id"] = expense_id
+        on_change(data)
+
+    return doc_ref.on_snapshot(_on_snapshot)
+
+
+async def update_expense_status(expense_id: str, status: str) -> None:
+    """Update expense status in Firestore"""
+    doc_ref = _get_client().collection("expenses").document(expense_id)
+    audit_entry = {"actor": "orchestrator", "action": f"STATUS:{status}", "ts": datetime.now(timezone.utc).isoformat()}
+    batch = _get_client().batch()
+    batch.update(
+        doc_ref,
         {
             "status": status,
             "version": firestore.Increment(1),
-            "updatedAt": datetime.now(timezone.utc),
-            "auditLog": firestore.ArrayUnion(
-                [{"actor": "orchestrator", "action": f"STATUS:{status}", "ts": datetime.now(timezone.utc).isoformat()}]
-            ),
-        }
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        },
     )
-
-
+    # The audit entry lives only in the subcollection so the parent write stays constant-size
+    batch.create(doc_ref.collection("auditLog").document(), audit_entry)
+    await batch.commit()
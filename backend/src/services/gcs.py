@@ -1,15 +1,43 @@
+import asyncio
 import os
 from typing import Optional
 
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+
+
+# Receipts at or below this size go up in one multipart request; larger ones
+# use a chunked resumable upload
+RESUMABLE_THRESHOLD_BYTES = 8 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+_client: Optional[storage.Client] = None
+
+
+def _get_client() -> storage.Client:
+    global _client
+    if _client is None:
+        _client = storage.Client(project=os.getenv("PROJECT_ID"))
+    return _client
 
 
 async def upload_file_to_gcs(bucket_name: str, object_name: str, file) -> str:
-    client = storage.Client(project=os.getenv("PROJECT_ID"))
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(object_name)
-    # Upload in chunks from UploadFile
-    blob.upload_from_file(file.file, rewind=True, content_type=file.content_type)
+    bucket = _get_client().bucket(bucket_name)
+    size = file.size
+    chunk_size = UPLOAD_CHUNK_SIZE if size is None or size > RESUMABLE_THRESHOLD_BYTES else None
+    blob = bucket.blob(object_name, chunk_size=chunk_size)
+    # Upload in chunks from UploadFile on a worker thread to keep the event loop free
+    await asyncio.to_thread(
+        blob.upload_from_file,
+        file.file,
+        rewind=True,
+        size=size,
+        content_type=file.content_type,
+        retry=DEFAULT_RETRY,
+    )
     return f"gs://{bucket_name}/{object_name}"
 
 
+def warm_client(bucket_name: str) -> None:
+    """Create the shared client and open its connection pool before the first upload"""
+    _get_client().bucket(bucket_name).exists()
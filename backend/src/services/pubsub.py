@@ -1,26 +1,59 @@
+import asyncio
 import os
-import json
-from typing import Dict
+import logging
+from typing import Dict, Set
 
+import orjson
 from google.cloud import pubsub_v1
 
 
+logger = logging.getLogger(__name__)
+
 _publisher = None
+# Keeps fire-and-forget publish futures referenced until they settle
+_pending_publishes: Set[pubsub_v1.publisher.futures.Future] = set()
 
 
 def _get_publisher() -> pubsub_v1.PublisherClient:
     global _publisher
     if _publisher is None:
-        _publisher = pubsub_v1.PublisherClient()
+        _publisher = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=100,
+                max_bytes=1 << 20,
+                max_latency=0.05,
+            )
+        )
     return _publisher
 
 
-def publish_event(topic: str, message: Dict) -> None:
-    """Publish event to Pub/Sub topic (synchronous)"""
+def _on_publish_done(future: pubsub_v1.publisher.futures.Future) -> None:
+    _pending_publishes.discard(future)
+    try:
+        future.result()
+    except Exception as exc:
+        logger.error("Failed to publish event: %s", exc)
+
+
+def publish_event(topic: str, message: Dict, wait: bool = False) -> pubsub_v1.publisher.futures.Future:
+    """Publish event to Pub/Sub topic, blocking for the ack only when wait=True"""
     project_id = os.getenv("PROJECT_ID")
     topic_path = _get_publisher().topic_path(project_id, topic)
-    data = json.dumps(message).encode("utf-8")
+    data = orjson.dumps(message)
     future = _get_publisher().publish(topic_path, data)
-    future.result(timeout=30)  # Block until published
+    if wait:
+        future.result(timeout=30)  # Block until published
+        return future
+    _pending_publishes.add(future)
+    future.add_done_callback(_on_publish_done)
+    return future
+
+
+async def publish_event_async(topic: str, message: Dict) -> None:
+    """Publish event to Pub/Sub topic and await the ack without blocking the event loop"""
+    await asyncio.wrap_future(publish_event(topic, message))
 
 
+def warm_publisher(topic: str) -> None:
+    """Create the shared publisher so the first submission does not pay channel setup"""
+    _get_publisher().topic_path(os.getenv("PROJECT_ID"), topic)
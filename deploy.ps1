@@ -26,6 +26,7 @@ gsutil mb -l $Region gs://$ProjectId-auditai-receipts 2>$null | Out-Null
 gsutil mb -l $Region gs://$ProjectId-auditai-policies 2>$null | Out-Null
 gsutil mb -l $Region gs://$ProjectId-auditai-reports 2>$null | Out-Null
 gcloud firestore databases create --location=$Region 2>$null | Out-Null
+gcloud firestore indexes composite create --collection-group=expenses --field-config=field-path=findings.extraction.merchant,order=ascending --field-config=field-path=createdAt,order=descending 2>$null | Out-Null
 
 Write-Host "Creating Pub/Sub topics..." -ForegroundColor Cyan
 foreach ($t in @("expenses.ingested","expenses.extracted","expenses.evaluated","expenses.analyzed","expenses.finalized")) {
@@ -45,6 +46,7 @@ Write-Host "  Env (extraction): PROJECT_ID=$ProjectId, REGION=$Region, MODEL_LOC
 Write-Host "  Env (policy):     PROJECT_ID=$ProjectId, REGION=$Region, MODEL_LOCATION=global, POLICY_MODEL_LOCATION=global, AGENT_TYPE=policy, SUBSCRIPTION=expenses.extracted.policy, TOPIC_OUT=expenses.evaluated, POLICY_BUCKET=$ProjectId-auditai-policies, POLICY_MODEL=gemini-2.5-flash-lite-preview-09-2025, AGENT_QPS=2, MAX_INFLIGHT_MESSAGES=2, MAX_INFLIGHT_BYTES=2097152"
 Write-Host "  Env (anomaly):    PROJECT_ID=$ProjectId, REGION=$Region, MODEL_LOCATION=global, AGENT_TYPE=anomaly, SUBSCRIPTION=expenses.evaluated.anomaly, TOPIC_OUT=expenses.analyzed, AGENT_QPS=2, MAX_INFLIGHT_MESSAGES=2, MAX_INFLIGHT_BYTES=2097152"
 Write-Host "  Env (remediation):PROJECT_ID=$ProjectId, REGION=$Region, MODEL_LOCATION=global, AGENT_TYPE=remediation, SUBSCRIPTION=expenses.analyzed.remediation, TOPIC_OUT=, AGENT_QPS=2, MAX_INFLIGHT_MESSAGES=2, MAX_INFLIGHT_BYTES=2097152"
+Write-Host "  Env (post-extraction, replaces policy+anomaly): PROJECT_ID=$ProjectId, REGION=$Region, MODEL_LOCATION=global, POLICY_MODEL_LOCATION=global, AGENT_TYPE=parallel_post_extraction, SUBSCRIPTION=expenses.extracted.post, TOPIC_OUT=expenses.analyzed, POLICY_BUCKET=$ProjectId-auditai-policies, POLICY_MODEL=gemini-2.5-flash-lite-preview-09-2025, AGENT_QPS=2, MAX_INFLIGHT_MESSAGES=2, MAX_INFLIGHT_BYTES=2097152"
 
 Write-Host ""
 Write-Host "Run job (after first data):" -ForegroundColor Yellow
@@ -23,6 +23,9 @@ gsutil mb -l "${REGION}" "gs://${PROJECT_ID}-auditai-receipts" || true
 gsutil mb -l "${REGION}" "gs://${PROJECT_ID}-auditai-policies" || true
 gsutil mb -l "${REGION}" "gs://${PROJECT_ID}-auditai-reports" || true
 gcloud firestore databases create --location="${REGION}" || true
+gcloud firestore indexes composite create --collection-group=expenses \
+  --field-config=field-path=findings.extraction.merchant,order=ascending \
+  --field-config=field-path=createdAt,order=descending || true
 
 for t in expenses.ingested expenses.extracted expenses.evaluated expenses.analyzed expenses.finalized; do
   gcloud pubsub topics create "$t" || true
@@ -146,6 +146,17 @@ export default function Page() {
 
     const handleFinalStatus = (finalStatus: string, doc?: any) => {
       markRealUpdate();
+      // Remediation is persisted together with the verdict, so it only appears here
+      const remediation = doc?.findings?.remediation;
+      if (remediation) {
+        const message = remediation.needs_remediation
+          ? `💡 Recommendations: ${(remediation.recommendations ?? [])
+              .map((r: any) => r.action)
+              .slice(0, 2)
+              .join('; ')}`
+          : '✅ No remediation needed.';
+        pushUpdate('Remediation Agent', 'complete', message);
+      }
       const synthesis = doc?.findings?.synthesis;
       const summary =
         synthesis?.summary ??
@@ -262,20 +273,6 @@ export default function Page() {
             pushUpdate('Anomaly Agent', 'error', '❌ Anomaly detection failed.');
             break;
           }
-          case 'REMEDIATION_COMPLETE': {
-            if (findings.remediation) {
-              markRealUpdate();
-              const remediation = findings.remediation;
-              const message = remediation.needs_remediation
-                ? `💡 Recommendations: ${remediation.recommendations
-                    .map((r: any) => r.action)
-                    .slice(0, 2)
-                    .join('; ')}`
-                : '✅ No remediation needed.';
-              pushUpdate('Remediation Agent', 'complete', message);
-            }
-            break;
-          }
           case 'APPROVED':
           case 'REJECTED':
           case 'NEEDS_REVIEW':
@@ -8,38 +8,63 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 REGION = os.getenv("REGION", "us-central1")
 REPORT_BUCKET = os.getenv("REPORT_BUCKET", f"{PROJECT_ID}-auditai-reports")
 
+# Only the fields written to the report are read from Firestore
+EXPORT_FIELDS = [
+    "status",
+    "final.status",
+    "extraction.fields.total",
+    "extraction.fields.merchant",
+    "policy.score",
+]
+PAGE_SIZE = 1000
+
+
+def _iter_expenses(fs: firestore.Client):
+    """Yield projected expense snapshots one page at a time."""
+    query = (
+        fs.collection("expenses")
+        .select(EXPORT_FIELDS)
+        .order_by(firestore.FieldPath.document_id())
+        .limit(PAGE_SIZE)
+    )
+    last = None
+    while True:
+        page = query.start_after(last) if last is not None else query
+        docs = list(page.stream())
+        yield from docs
+        if len(docs) < PAGE_SIZE:
+            return
+        last = docs[-1]
+
 
 def run():
     fs = firestore.Client(project=PROJECT_ID)
     st = storage.Client(project=PROJECT_ID)
 
-    docs = fs.collection("expenses").stream()
-    rows = [["expenseId", "status", "decision", "total", "merchant", "score"]]
-    for d in docs:
-        v = d.to_dict()
-        rows.append(
-            [
-                d.id,
-                v.get("status"),
-                (v.get("final") or {}).get("status"),
-                ((v.get("extraction") or {}).get("fields") or {}).get("total"),
-                ((v.get("extraction") or {}).get("fields") or {}).get("merchant"),
-                (v.get("policy") or {}).get("score"),
-            ]
-        )
-
     now = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
     filename = f"reports/audit-{now}.csv"
     bucket = st.bucket(REPORT_BUCKET)
     blob = bucket.blob(filename)
 
+    # Rows are written to GCS as they stream in rather than collected in memory
     with blob.open("w") as f:
         writer = csv.writer(f)
-        writer.writerows(rows)
+        writer.writerow(["expenseId", "status", "decision", "total", "merchant", "score"])
+        for d in _iter_expenses(fs):
+            v = d.to_dict()
+            writer.writerow(
+                [
+                    d.id,
+                    v.get("status"),
+                    (v.get("final") or {}).get("status"),
+                    ((v.get("extraction") or {}).get("fields") or {}).get("total"),
+                    ((v.get("extraction") or {}).get("fields") or {}).get("merchant"),
+                    (v.get("policy") or {}).get("score"),
+                ]
+            )
 
     print(f"Wrote gs://{REPORT_BUCKET}/{filename}")
 
 
 if __name__ == "__main__":
     run()
-
@@ -14,7 +14,7 @@ def healthz():
 @app.post("/internal/synthesize/{expense_id}")
 def synthesize(expense_id: str):
     ref = fs.collection("expenses").document(expense_id)
-    snap = ref.get()
+    snap = ref.get(field_paths=["final.status", "status"])
     if not snap.exists:
         raise HTTPException(404, "Not found")
     data = snap.to_dict()